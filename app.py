@@ -1,12 +1,19 @@
 import os
+import re
+import asyncio
 import datetime
 import logging
-import traceback
+import zipfile
+from io import BytesIO
+from collections import OrderedDict
+from functools import lru_cache
+from urllib.parse import quote
 
+import anyio.to_thread
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
 from fpdf import FPDF
 from dotenv import load_dotenv
 
@@ -29,23 +36,30 @@ logger = logging.getLogger("propsely")
 # -------------------------------------------------
 APP_NAME = os.getenv("APP_NAME", "Propsely")
 
-# Local: ./generated_pdfs
-# Render: /tmp/generated_pdfs
-PDF_OUTPUT_DIR = os.getenv("PDF_OUTPUT_DIR", "./generated_pdfs")
+# Max FPDF documents rendered at once per worker; extra renders wait their
+# turn. Only cache misses take a token, and the shared threadpool is untouched.
+PDF_CONCURRENCY = int(os.getenv("PDF_CONCURRENCY", str(os.cpu_count() or 1)))
+pdf_limiter = anyio.CapacityLimiter(PDF_CONCURRENCY)
+
+# Number of rendered PDFs kept in memory for identical re-submissions
+PDF_CACHE_SIZE = int(os.getenv("PDF_CACHE_SIZE", "256"))
 
 app = FastAPI(title=APP_NAME)
 
 # -------------------------------------------------
 # ✅ CORS (FIXED — NO "*", NO DUPLICATES)
 # -------------------------------------------------
+# A frozenset keeps the per-request origin check O(1)
+CORS_ORIGINS = frozenset({
+    "https://proposely.lovable.app",
+    "https://propsely-front.vercel.app",
+    "http://localhost:3000",
+    "http://localhost:5173",
+})
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[
-        "https://proposely.lovable.app",
-        "https://propsely-front.vercel.app",
-        "http://localhost:3000",
-        "http://localhost:5173",
-    ],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -55,53 +69,78 @@ app.add_middleware(
 # Models
 # -------------------------------------------------
 class ProposalRequest(BaseModel):
-    client_name: str
-    project_type: str
+    # Bounded so cached PDFs (keyed on these strings) stay small
+    client_name: str = Field(max_length=200)
+    project_type: str = Field(max_length=200)
     project_budget: float | None = None
 
+class HealthResponse(BaseModel):
+    status: str
+    app: str
+
+class BatchProposalRequest(BaseModel):
+    items: list[ProposalRequest] = Field(min_length=1, max_length=50)
+
 # -------------------------------------------------
 # Helpers
 # -------------------------------------------------
+# Anything other than word characters, spaces and hyphens
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^\w -]+")
+
 def safe_filename(name: str) -> str:
-    clean = "".join(c for c in name if c.isalnum() or c in (" ", "-", "_")).strip()
+    clean = _UNSAFE_FILENAME_CHARS.sub("", name).strip()
     return clean.replace(" ", "_") if clean else "client"
 
+@lru_cache(maxsize=2)
+def _format_date(ordinal: int) -> str:
+    return datetime.date.fromordinal(ordinal).strftime("%d-%m-%Y")
+
+def today_str() -> str:
+    # strftime runs once per day instead of once per request
+    return _format_date(datetime.date.today().toordinal())
+
+def attachment_headers(filename: str) -> dict[str, str]:
+    # Same encoding rules as Starlette's FileResponse (RFC 6266 / 5987)
+    quoted = quote(filename)
+    if quoted != filename:
+        disposition = f"attachment; filename*=utf-8''{quoted}"
+    else:
+        disposition = f'attachment; filename="{filename}"'
+    return {"Content-Disposition": disposition}
+
+# Built once; str.translate handles multi-char replacements in one pass
+_LATIN1_TRANSLATION = str.maketrans({
+    "—": "-",
+    "–": "-",
+    "“": '"',
+    "”": '"',
+    "‘": "'",
+    "’": "'",
+    "…": "...",
+    "₹": "Rs ",
+    "™": "TM",
+})
+
 def sanitize_text(text: str) -> str:
     """
-    pyFPDF only supports latin-1.
+    fpdf2 core fonts only support latin-1.
     Replace common unicode characters safely.
     """
     if not text:
         return ""
 
-    replacements = {
-        "—": "-",
-        "–": "-",
-        "“": '"',
-        "”": '"',
-        "‘": "'",
-        "’": "'",
-        "…": "...",
-        "₹": "Rs ",
-    }
-
-    for k, v in replacements.items():
-        text = text.replace(k, v)
+    text = text.translate(_LATIN1_TRANSLATION)
+    if text.isascii():
+        return text
 
     return text.encode("latin-1", errors="replace").decode("latin-1")
 
 # -------------------------------------------------
 # Proposal Text Generator
 # -------------------------------------------------
-def generate_proposal_text(name: str, project: str, budget: float | None) -> str:
-    today = datetime.date.today().strftime("%d-%m-%Y")
-    price = (
-        f"Estimated Budget: Rs {budget:,.2f}"
-        if budget
-        else "Pricing will be finalized after discussion."
-    )
-
-    return f"""
+# Static skeleton is sanitized once at import; only client fields are
+# sanitized per request.
+PROPOSAL_TEMPLATE = sanitize_text("""
 PROSELY — AUTO PROPOSAL & QUOTATION
 Generated on: {today}
 
@@ -148,50 +187,108 @@ We deliver high-quality work, clear communication and reliable timelines.
 
 Regards,
 Team Propsely
-"""
+""")
+
+# Pre-split skeleton: (line, has_placeholders). Blank lines are normalized
+# to "" so the PDF loop can test them by truthiness.
+PROPOSAL_LINES = [
+    (line if line.strip() else "", "{" in line)
+    for line in PROPOSAL_TEMPLATE.splitlines()
+]
+
+def generate_proposal_lines(
+    name: str, project: str, budget: float | None, today: str
+) -> list[str]:
+    """Return the proposal as lines, already sanitized for the PDF fonts."""
+    price = (
+        f"Estimated Budget: Rs {budget:,.2f}"
+        if budget
+        else "Pricing will be finalized after discussion."
+    )
+    fields = {
+        "today": today,
+        "name": sanitize_text(name),
+        "project": sanitize_text(project),
+        "price": price,
+    }
+
+    return [
+        line.format_map(fields) if dynamic else line
+        for line, dynamic in PROPOSAL_LINES
+    ]
 
 # -------------------------------------------------
 # PDF Generator
 # -------------------------------------------------
-def generate_pdf(text: str, client_name: str) -> str:
+def generate_pdf(lines: list[str]) -> bytes:
     try:
-        os.makedirs(PDF_OUTPUT_DIR, exist_ok=True)
-
-        filename = f"{safe_filename(client_name)}_proposal.pdf"
-        file_path = os.path.abspath(os.path.join(PDF_OUTPUT_DIR, filename))
-
         pdf = FPDF()
         pdf.set_auto_page_break(auto=True, margin=12)
         pdf.add_page()
 
-        try:
-            pdf.set_font("Arial", size=12)
-        except Exception:
-            pdf.set_font("Times", size=12)
+        pdf.set_font("Helvetica", size=12)
 
-        for line in sanitize_text(text).splitlines():
-            if line.strip():
-                pdf.multi_cell(0, 7, line)
+        # lines come from generate_proposal_lines, already sanitized
+        for line in lines:
+            if line:
+                pdf.multi_cell(0, 7, line, new_x="LMARGIN", new_y="NEXT")
             else:
                 pdf.ln(4)
 
-        pdf.output(file_path)
-        logger.info("PDF created at %s", file_path)
-        return file_path
+        data = bytes(pdf.output())
+        logger.info("PDF created (%d bytes)", len(data))
+        return data
 
-    except Exception as e:
-        logger.error("PDF generation failed: %s", traceback.format_exc())
+    except Exception:
+        logger.exception("PDF generation failed")
         raise HTTPException(status_code=500, detail="PDF generation failed")
 
+def build_proposal_pdf(
+    name: str, project: str, budget: float | None, today: str
+) -> bytes:
+    return generate_pdf(generate_proposal_lines(name, project, budget, today))
+
+# Rendered PDFs keyed on (name, project, budget, today); today is part of
+# the key so cached PDFs never carry a stale date. Only touched from the
+# event loop, so no locking is needed.
+_pdf_cache: OrderedDict[tuple, bytes] = OrderedDict()
+
+async def render_proposal(payload: ProposalRequest, today: str) -> bytes:
+    key = (payload.client_name, payload.project_type, payload.project_budget, today)
+
+    # Cache hits are served straight from the event loop
+    data = _pdf_cache.get(key)
+    if data is not None:
+        _pdf_cache.move_to_end(key)
+        return data
+
+    # FPDF rendering is CPU-bound; keep it off the event loop
+    data = await anyio.to_thread.run_sync(
+        build_proposal_pdf, *key, limiter=pdf_limiter
+    )
+
+    _pdf_cache[key] = data
+    if len(_pdf_cache) > PDF_CACHE_SIZE:
+        _pdf_cache.popitem(last=False)
+    return data
+
+def build_proposals_zip(files: list[tuple[str, bytes]]) -> bytes:
+    buf = BytesIO()
+    # PDFs are already compressed; storing avoids a pointless deflate pass
+    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_STORED) as zf:
+        for filename, data in files:
+            zf.writestr(filename, data)
+    return buf.getvalue()
+
 # -------------------------------------------------
 # Routes
 # -------------------------------------------------
 @app.get("/")
-def health():
-    return {"status": "ok", "app": APP_NAME}
+async def health() -> HealthResponse:
+    return HealthResponse(status="ok", app=APP_NAME)
 
 @app.post("/generate-proposal")
-def generate_proposal(payload: ProposalRequest):
+async def generate_proposal(payload: ProposalRequest):
     logger.info(
         "Generate proposal: client=%s project=%s budget=%s",
         payload.client_name,
@@ -199,19 +296,34 @@ def generate_proposal(payload: ProposalRequest):
         payload.project_budget,
     )
 
-    content = generate_proposal_text(
-        payload.client_name,
-        payload.project_type,
-        payload.project_budget,
+    today = today_str()
+    pdf_bytes = await render_proposal(payload, today)
+    filename = f"{safe_filename(payload.client_name)}_proposal.pdf"
+
+    return Response(
+        pdf_bytes,
+        media_type="application/pdf",
+        headers=attachment_headers(filename),
     )
 
-    pdf_path = generate_pdf(content, payload.client_name)
+@app.post("/generate-proposals")
+async def generate_proposals(payload: BatchProposalRequest):
+    logger.info("Generate proposals batch: items=%d", len(payload.items))
 
-    if not os.path.exists(pdf_path):
-        raise HTTPException(status_code=500, detail="PDF not created")
+    today = today_str()
+    pdfs = await asyncio.gather(
+        *(render_proposal(item, today) for item in payload.items)
+    )
 
-    return FileResponse(
-        pdf_path,
-        media_type="application/pdf",
-        filename=os.path.basename(pdf_path),
+    # Number entries so repeated client names don't overwrite each other
+    files = [
+        (f"{i:02d}_{safe_filename(item.client_name)}_proposal.pdf", data)
+        for i, (item, data) in enumerate(zip(payload.items, pdfs), start=1)
+    ]
+    zip_bytes = build_proposals_zip(files)
+
+    return Response(
+        zip_bytes,
+        media_type="application/zip",
+        headers=attachment_headers("proposals.zip"),
     )